@@ -101,7 +101,49 @@ FB_PAGE_NAME = os.getenv("FB_PAGE_NAME", "Noticias del Meta")
 META_APP_ID = os.getenv("META_APP_ID")
 META_APP_SECRET = os.getenv("META_APP_SECRET")
 
+# Tokens de Meta guardados en BD (ver mentions/tokens.py)
+# Clave Fernet para cifrarlos; si no se define se deriva de DJANGO_SECRET_KEY
+TOKEN_ENCRYPTION_KEY = os.getenv("TOKEN_ENCRYPTION_KEY") or None
+# Renovar el token de usuario cuando le quede menos que esto (segundos)
+TOKEN_REFRESH_MARGIN = int(os.getenv("TOKEN_REFRESH_MARGIN", str(7 * 24 * 3600)))
+
 # Configuración X (antes Twitter)
 X_API_BASE = os.getenv("X_API_BASE", "https://api.x.com/2")
 X_BEARER_TOKEN = os.getenv("X_BEARER_TOKEN")
-X_USERNAME = os.getenv("X_USERNAME")
\ No newline at end of file
+X_USERNAME = os.getenv("X_USERNAME")
+# Idiomas de las menciones de X, separados por comas (vacío = todos)
+X_LANGS = os.getenv("X_LANGS", "es,en,pt")
+
+# Caché de menciones (segundos). 0 desactiva la caché en servidor y navegador.
+MENTIONS_CACHE_TTL = int(os.getenv("MENTIONS_CACHE_TTL", "60"))
+
+# Análisis de sentimiento (ver mentions/sentiment.py)
+# Ruta a un modelo entrenado con `manage.py train_sentiment`; si no existe se usa el léxico base
+SENTIMENT_MODEL_PATH = os.getenv("SENTIMENT_MODEL_PATH") or None
+SENTIMENT_WORKERS = int(os.getenv("SENTIMENT_WORKERS", "1"))  # 0 = mismo proceso
+SENTIMENT_BATCH_SIZE = int(os.getenv("SENTIMENT_BATCH_SIZE", "256"))
+SENTIMENT_TIMEOUT = float(os.getenv("SENTIMENT_TIMEOUT", "2.0"))  # segundos antes de usar el léxico
+SENTIMENT_MAX_PENDING = int(os.getenv("SENTIMENT_MAX_PENDING", "8"))
+SENTIMENT_CACHE_TTL = int(os.getenv("SENTIMENT_CACHE_TTL", str(7 * 24 * 3600)))
+
+# Alertas sobre el flujo de menciones (ver mentions/alerts.py).
+# MENTIONS_ALERTS_ENABLED controla la evaluación en el servidor web: ponlo a
+# False si usas `manage.py watch_mentions`, que evalúa siempre; si no, cada
+# proceso web y el watcher enviarían la misma alerta por separado.
+MENTIONS_ALERTS_ENABLED = os.getenv("MENTIONS_ALERTS_ENABLED", "True") == "True"
+# Sinks disponibles: mentions.alerts.LogSink, mentions.alerts.EmailSink, mentions.alerts.WebhookSink
+MENTIONS_ALERT_SINKS = [
+    path.strip()
+    for path in os.getenv("MENTIONS_ALERT_SINKS", "mentions.alerts.LogSink").split(",")
+    if path.strip()
+]
+# Parámetros de AlertEvaluator (ventana, umbrales, cooldown...)
+MENTIONS_ALERT_OPTIONS = {
+    "window_seconds": int(os.getenv("ALERT_WINDOW_SECONDS", "900")),
+    "bucket_seconds": int(os.getenv("ALERT_BUCKET_SECONDS", "60")),
+    "burst_threshold": int(os.getenv("ALERT_BURST_THRESHOLD", "5")),
+}
+ALERT_EMAIL_RECIPIENTS = [
+    email.strip() for email in os.getenv("ALERT_EMAIL_RECIPIENTS", "").split(",") if email.strip()
+]
+ALERT_WEBHOOK_URL = os.getenv("ALERT_WEBHOOK_URL")
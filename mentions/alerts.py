@@ -0,0 +1,454 @@
+"""
+Alertas sobre el flujo de menciones ya puntuadas.
+
+AlertEvaluator recibe las menciones nuevas y mantiene conteos en una ventana
+deslizante de tamaño fijo (anillo de buckets por tiempo), de modo que la
+memoria y el coste de evaluar no dependen del histórico. Detecta:
+
+  - negative_spike: la tasa de menciones negativas de los últimos minutos
+    supera la línea base (media móvil exponencial, EWMA, de la tasa de cada
+    bucket) en más de k desviaciones.
+  - author_burst: un mismo autor publica muchas menciones dentro de la
+    ventana (conteo aproximado con un Count-Min Sketch por bucket).
+
+Las alertas se envían a los sinks configurados en MENTIONS_ALERT_SINKS.
+"""
+import logging
+import math
+import threading
+import time
+import zlib
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+import requests
+from django.conf import settings
+from django.core.mail import send_mail
+from django.utils.module_loading import import_string
+
+logger = logging.getLogger(__name__)
+
+SENTIMENTS = ("positive", "neutral", "negative")
+
+
+# --- Sinks ---
+
+class LogSink:
+    """Escribe la alerta en el log `mentions.alerts`."""
+
+    def send(self, alert):
+        logger.warning("[%s] %s", alert["kind"], alert["message"])
+
+
+class EmailSink:
+    """Envía la alerta por correo a ALERT_EMAIL_RECIPIENTS."""
+
+    def send(self, alert):
+        recipients = getattr(settings, "ALERT_EMAIL_RECIPIENTS", [])
+        if not recipients:
+            return
+        send_mail(
+            subject=f"Alerta de menciones: {alert['kind']}",
+            message=alert["message"],
+            from_email=None,
+            recipient_list=recipients,
+        )
+
+
+class WebhookSink:
+    """
+    Publica la alerta como JSON en ALERT_WEBHOOK_URL. Si no hay URL
+    configurada, solo la registra en el log (útil en desarrollo).
+    """
+
+    def send(self, alert):
+        url = getattr(settings, "ALERT_WEBHOOK_URL", None)
+        if not url:
+            logger.info("Webhook sin URL configurada, alerta no enviada: %s", alert)
+            return
+        resp = requests.post(url, json=alert, timeout=5)
+        resp.raise_for_status()
+
+
+# --- Estructuras de memoria constante ---
+
+class CountMinSketch:
+    """Conteo aproximado (nunca por debajo del real) con memoria fija."""
+
+    def __init__(self, width=512, depth=4):
+        self.width = width
+        self.depth = depth
+        self.table = array("I", [0]) * (width * depth)
+
+    def _cells(self, key):
+        data = key.encode("utf-8")
+        for row in range(self.depth):
+            yield row * self.width + zlib.crc32(data, row) % self.width
+
+    def add(self, key, count=1):
+        for cell in self._cells(key):
+            self.table[cell] += count
+
+    def estimate(self, key):
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def clear(self):
+        self.table = array("I", [0]) * (self.width * self.depth)
+
+
+class _Bucket:
+    def __init__(self):
+        self.stamp = None  # índice absoluto del bucket (ts // bucket_seconds)
+        self.counts = {}  # (network, sentiment) -> conteo
+        self.authors = CountMinSketch()
+
+    def reset(self, stamp):
+        self.stamp = stamp
+        self.counts = {}
+        self.authors.clear()
+
+
+class _Ewma:
+    """Media y varianza móviles exponenciales."""
+
+    def __init__(self, alpha):
+        self.alpha = alpha
+        self.mean = 0.0
+        self.var = 0.0
+        self.samples = 0
+
+    def update(self, value):
+        if self.samples == 0:
+            self.mean = value
+        else:
+            diff = value - self.mean
+            incr = self.alpha * diff
+            self.mean += incr
+            self.var = (1 - self.alpha) * (self.var + diff * incr)
+        self.samples += 1
+
+
+class _BoundedSet:
+    """Conjunto con los últimos `limit` elementos (para deduplicar ids)."""
+
+    def __init__(self, limit):
+        self.limit = limit
+        self.items = OrderedDict()
+
+    def add(self, key):
+        """Devuelve True si el elemento es nuevo."""
+        if key in self.items:
+            self.items.move_to_end(key)
+            return False
+        self.items[key] = None
+        if len(self.items) > self.limit:
+            self.items.popitem(last=False)
+        return True
+
+
+# --- Evaluador ---
+
+def _parse_timestamp(value):
+    if not value:
+        return None
+    try:
+        return datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp()
+    except (AttributeError, ValueError):
+        return None
+
+
+class AlertEvaluator:
+    def __init__(
+        self,
+        window_seconds=900,
+        bucket_seconds=60,
+        ewma_alpha=0.1,
+        spike_sigma=3.0,
+        spike_min_delta=0.15,
+        spike_min_mentions=5,
+        recent_seconds=180,
+        warmup_buckets=5,
+        burst_threshold=5,
+        cooldown_seconds=900,
+        seen_limit=10000,
+    ):
+        self.bucket_seconds = bucket_seconds
+        self.buckets = [_Bucket() for _ in range(max(1, window_seconds // bucket_seconds))]
+        self.ewma_alpha = ewma_alpha
+        self.spike_sigma = spike_sigma
+        self.spike_min_delta = spike_min_delta
+        self.spike_min_mentions = spike_min_mentions
+        # La ventana corta debe caber en el anillo y dejar sitio a la línea base
+        self.recent_buckets = max(1, min(recent_seconds // bucket_seconds, len(self.buckets) - 1))
+        self.warmup_buckets = warmup_buckets
+        self.burst_threshold = burst_threshold
+        self.cooldown_seconds = cooldown_seconds
+
+        self.baselines = {}  # network ("all" incluido) -> _Ewma
+        self.active_spikes = {}  # network -> bucket en que empezó el pico
+        self.last_closed = None
+        self.seen = _BoundedSet(seen_limit)
+        self.last_alerts = OrderedDict()  # clave de alerta -> ts, acotado
+        self.lock = threading.Lock()
+
+    # Ventana
+
+    def _bucket_for(self, stamp):
+        bucket = self.buckets[stamp % len(self.buckets)]
+        if bucket.stamp != stamp:
+            bucket.reset(stamp)
+        return bucket
+
+    def _live_buckets(self, current, size=None):
+        """Buckets de los últimos `size` intervalos (por defecto, toda la ventana)."""
+        oldest = current - (size or len(self.buckets)) + 1
+        return [b for b in self.buckets if b.stamp is not None and oldest <= b.stamp <= current]
+
+    def window_counts(self, current):
+        """Conteos (network, sentiment) de la ventana que termina en `current`."""
+        totals = {}
+        for bucket in self._live_buckets(current):
+            for key, count in bucket.counts.items():
+                totals[key] = totals.get(key, 0) + count
+        return totals
+
+    def _negative_rates(self, buckets):
+        """Tasa de negativas y total de los buckets dados, por red y para "all"."""
+        per_network = {}
+        for bucket in buckets:
+            for (network, label), count in bucket.counts.items():
+                for key in (network, "all"):
+                    negatives, total = per_network.get(key, (0, 0))
+                    per_network[key] = (
+                        negatives + (count if label == "negative" else 0),
+                        total + count,
+                    )
+        return {
+            network: (negatives / total, total)
+            for network, (negatives, total) in per_network.items()
+            if total
+        }
+
+    def _close_buckets(self, current):
+        """
+        Alimenta la línea base con una muestra por bucket: la tasa de negativas
+        de ese bucket solo, cuando sale de la ventana corta. Así la línea base
+        no se solapa con la tasa que se compara contra ella, y las menciones
+        que llegan con retraso a un bucket ya cuentan. Mientras una red está en
+        pico su línea base no se actualiza, salvo que el pico dure más que la
+        ventana completa (se asume que es el nuevo nivel habitual).
+        """
+        last = current - self.recent_buckets
+        if self.last_closed is None:
+            self.last_closed = last
+            return
+        # Tras una pausa larga solo quedan en el anillo los de la última ventana
+        start = max(self.last_closed + 1, current - len(self.buckets) + 1)
+        for stamp in range(start, last + 1):
+            bucket = self.buckets[stamp % len(self.buckets)]
+            if bucket.stamp != stamp:
+                continue
+            for network, (rate, _) in self._negative_rates([bucket]).items():
+                spike_start = self.active_spikes.get(network)
+                if spike_start is not None and stamp - spike_start < len(self.buckets):
+                    continue
+                baseline = self.baselines.setdefault(network, _Ewma(self.ewma_alpha))
+                baseline.update(rate)
+        self.last_closed = max(self.last_closed, last)
+
+    # Alertas
+
+    def _should_alert(self, key, now):
+        last = self.last_alerts.get(key)
+        if last is not None and now - last < self.cooldown_seconds:
+            return False
+        self.last_alerts[key] = now
+        self.last_alerts.move_to_end(key)
+        if len(self.last_alerts) > 1000:
+            self.last_alerts.popitem(last=False)
+        return True
+
+    def _is_spike(self, network, rate, total):
+        baseline = self.baselines.get(network)
+        if (
+            baseline is None
+            or baseline.samples < self.warmup_buckets
+            or total < self.spike_min_mentions
+        ):
+            return False
+        # Con pocas menciones la tasa de la ventana corta es ruidosa: la
+        # desviación no baja de la de una binomial con la tasa habitual (al
+        # menos una mención, para que una sola negativa no sea un pico)
+        p = max(baseline.mean, 1 / total)
+        noise = p * (1 - p) / total
+        threshold = max(
+            baseline.mean + self.spike_sigma * math.sqrt(max(baseline.var, noise)),
+            baseline.mean + self.spike_min_delta,
+        )
+        return rate > threshold
+
+    def _spike_alert(self, network, rate, total, now):
+        baseline = self.baselines[network]
+        minutes = self.recent_buckets * self.bucket_seconds // 60
+        return {
+            "kind": "negative_spike",
+            "network": network,
+            "value": round(rate, 3),
+            "baseline": round(baseline.mean, 3),
+            "mentions_in_window": total,
+            "created_at": now,
+            "message": (
+                f"Pico de menciones negativas en {network}: "
+                f"{rate:.0%} en los últimos {minutes} minutos frente a "
+                f"{baseline.mean:.0%} habitual ({total} menciones)."
+            ),
+        }
+
+    def _check_spikes(self, current, now):
+        rates = self._negative_rates(self._live_buckets(current, self.recent_buckets))
+        for network in list(self.active_spikes):
+            if network not in rates or not self._is_spike(network, *rates[network]):
+                del self.active_spikes[network]
+
+        alerts = []
+        for network, (rate, total) in rates.items():
+            if not self._is_spike(network, rate, total):
+                continue
+            self.active_spikes.setdefault(network, current)
+            if network != "all" and self._should_alert(f"spike:{network}", now):
+                alerts.append(self._spike_alert(network, rate, total, now))
+
+        # "all" solo aporta si el pico no se explica por una sola red: si hay
+        # una única red con menciones o alguna red ya está en pico, sería la
+        # misma incidencia repetida
+        networks = [n for n in rates if n != "all"]
+        if (
+            "all" in self.active_spikes
+            and len(networks) > 1
+            and not any(n in self.active_spikes for n in networks)
+            and self._should_alert("spike:all", now)
+        ):
+            alerts.append(self._spike_alert("all", *rates["all"], now))
+        return alerts
+
+    def _check_author(self, author_key, author_name, network, current, now):
+        count = sum(b.authors.estimate(author_key) for b in self._live_buckets(current))
+        if count < self.burst_threshold or not self._should_alert(f"author:{author_key}", now):
+            return None
+        return {
+            "kind": "author_burst",
+            "network": network,
+            "author": author_name,
+            "value": count,
+            "created_at": now,
+            "message": (
+                f"{author_name or 'Un autor'} publicó {count} menciones en {network} "
+                f"en los últimos {len(self.buckets) * self.bucket_seconds // 60} minutos."
+            ),
+        }
+
+    def consume(self, mentions, now=None):
+        """
+        Incorpora las menciones nuevas (las ya vistas se ignoran) y devuelve
+        la lista de alertas disparadas.
+        """
+        now = time.time() if now is None else now
+        current = int(now // self.bucket_seconds)
+        oldest = current - len(self.buckets) + 1
+        alerts = []
+
+        with self.lock:
+            self._close_buckets(current)
+
+            for m in mentions:
+                network = m.get("network") or "unknown"
+                if not self.seen.add((network, m.get("id"))):
+                    continue
+                ts = _parse_timestamp(m.get("created_time"))
+                stamp = current if ts is None else min(current, int(ts // self.bucket_seconds))
+                if stamp < oldest:
+                    # Fuera de la ventana: no aporta a la detección en curso
+                    continue
+
+                bucket = self._bucket_for(stamp)
+                label = (m.get("sentiment") or {}).get("label", "neutral")
+                key = (network, label if label in SENTIMENTS else "neutral")
+                bucket.counts[key] = bucket.counts.get(key, 0) + 1
+
+                author = m.get("from_id") or m.get("from_name")
+                if author:
+                    author_key = f"{network}:{author}"
+                    bucket.authors.add(author_key)
+                    alert = self._check_author(author_key, m.get("from_name"), network, current, now)
+                    if alert:
+                        alerts.append(alert)
+
+            alerts.extend(self._check_spikes(current, now))
+
+        return alerts
+
+
+# --- Punto de entrada ---
+
+_evaluator = None
+_evaluator_lock = threading.Lock()
+_sinks = None
+# Un solo hilo: las alertas se envían en orden y sin acumular hilos
+_dispatcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mentions-alerts")
+
+
+def get_evaluator():
+    global _evaluator
+    with _evaluator_lock:
+        if _evaluator is None:
+            _evaluator = AlertEvaluator(**getattr(settings, "MENTIONS_ALERT_OPTIONS", {}))
+        return _evaluator
+
+
+def get_sinks():
+    """
+    Instancia los sinks de MENTIONS_ALERT_SINKS una sola vez. Las rutas que no
+    se pueden importar se registran en el log y se omiten.
+    """
+    global _sinks
+    with _evaluator_lock:
+        if _sinks is None:
+            _sinks = []
+            for path in getattr(settings, "MENTIONS_ALERT_SINKS", ["mentions.alerts.LogSink"]):
+                try:
+                    _sinks.append(import_string(path)())
+                except Exception:
+                    logger.exception("No se pudo cargar el sink de alertas %s", path)
+        return _sinks
+
+
+def dispatch(alerts, sinks=None):
+    """Envía cada alerta a todos los sinks; un sink que falla no frena al resto."""
+    if not alerts:
+        return
+    sinks = get_sinks() if sinks is None else sinks
+    for alert in alerts:
+        for sink in sinks:
+            try:
+                sink.send(alert)
+            except Exception:
+                logger.exception("Error enviando alerta a %s", type(sink).__name__)
+
+
+def process(mentions):
+    """
+    Evalúa las menciones nuevas y despacha las alertas resultantes en un hilo
+    aparte, para que los sinks lentos (correo, webhook) no retrasen la
+    respuesta. Nunca lanza excepciones: un fallo de las alertas no debe
+    romper la consulta de menciones.
+    """
+    try:
+        alerts = get_evaluator().consume(mentions)
+        if alerts:
+            _dispatcher.submit(dispatch, alerts)
+        return alerts
+    except Exception:
+        logger.exception("Error evaluando alertas de menciones")
+        return []
@@ -0,0 +1,74 @@
+import csv
+import random
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from mentions.sentiment import NEUTRAL_BAND, HashedLinearModel, extract_features
+
+TARGETS = {"positive": 1.0, "neutral": 0.5, "negative": 0.0}
+
+
+class Command(BaseCommand):
+    help = (
+        "Entrena el modelo de sentimiento a partir de un CSV con columnas "
+        "text,label[,lang] (label: positive|neutral|negative). Parte de los "
+        "pesos del léxico base y guarda el resultado en JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("csv_path", help="CSV de entrenamiento")
+        parser.add_argument(
+            "--output",
+            default=getattr(settings, "SENTIMENT_MODEL_PATH", None) or "sentiment_model.json",
+            help="Ruta del modelo a generar (por defecto SENTIMENT_MODEL_PATH)",
+        )
+        parser.add_argument("--epochs", type=int, default=5)
+        parser.add_argument("--lr", type=float, default=0.1)
+        parser.add_argument("--l2", type=float, default=1e-6)
+
+    def handle(self, *args, **options):
+        try:
+            with open(options["csv_path"], newline="", encoding="utf-8") as fh:
+                rows = list(csv.DictReader(fh))
+        except OSError as e:
+            raise CommandError(f"No se pudo leer el CSV: {e}")
+
+        model = HashedLinearModel.from_lexicon()
+        examples = []
+        for row in rows:
+            target = TARGETS.get((row.get("label") or "").strip().lower())
+            if target is None or not row.get("text"):
+                continue
+            _, features = extract_features(row["text"], row.get("lang"), model.n_features)
+            examples.append((features, target))
+
+        if not examples:
+            raise CommandError("El CSV no tiene filas válidas (columnas text,label).")
+
+        rng = random.Random(0)
+        for epoch in range(options["epochs"]):
+            rng.shuffle(examples)
+            for features, target in examples:
+                model.partial_fit(features, target, lr=options["lr"], l2=options["l2"])
+            self.stdout.write(f"Época {epoch + 1}/{options['epochs']} completada")
+
+        def predicted_target(p):
+            if p >= 0.5 + NEUTRAL_BAND:
+                return 1.0
+            if p <= 0.5 - NEUTRAL_BAND:
+                return 0.0
+            return 0.5
+
+        correct = sum(
+            1
+            for features, target in examples
+            if predicted_target(model.probability(features)) == target
+        )
+        model.save(options["output"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Modelo guardado en {options['output']} "
+                f"({len(examples)} ejemplos, {correct / len(examples):.0%} aciertos en entrenamiento)"
+            )
+        )
@@ -0,0 +1,44 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from mentions import alerts, tokens, views
+
+
+class Command(BaseCommand):
+    help = (
+        "Consulta periódicamente las menciones de todas las redes y las pasa "
+        "por el evaluador de alertas, sin necesidad de tener el panel abierto. "
+        "Evalúa siempre, aunque MENTIONS_ALERTS_ENABLED sea False: ese ajuste "
+        "solo desactiva la evaluación en el servidor web."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval", type=int, default=60, help="Segundos entre consultas"
+        )
+        parser.add_argument(
+            "--once", action="store_true", help="Hacer una sola consulta y salir"
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            try:
+                # Renovar tokens de Instagram antes de que caduquen
+                refreshed = tokens.refresh_expiring_accounts()
+                if refreshed:
+                    self.stdout.write(f"{refreshed} tokens renovados")
+
+                # Sin sesión de usuario, vigilamos la última cuenta de Instagram conectada
+                account = tokens.get_account()
+                mentions = views._collect_mentions(
+                    "all", account.ig_user_id if account else None
+                )
+                fired = alerts.process(mentions)
+                self.stdout.write(f"{len(mentions)} menciones evaluadas, {len(fired)} alertas")
+            except Exception as e:
+                self.stderr.write(f"Error al consultar las menciones: {e}")
+
+            if options["once"]:
+                break
+            time.sleep(options["interval"])
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-19 06:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ConnectedAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ig_user_id', models.CharField(max_length=64, unique=True)),
+                ('username', models.CharField(blank=True, max_length=255)),
+                ('biography', models.TextField(blank=True)),
+                ('profile_picture_url', models.URLField(blank=True, max_length=1000)),
+                ('page_id', models.CharField(max_length=64)),
+                ('page_name', models.CharField(blank=True, max_length=255)),
+                ('user_token', models.TextField()),
+                ('page_token', models.TextField()),
+                ('user_token_expires_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,33 @@
+from django.db import models
+
+
+class ConnectedAccount(models.Model):
+    """
+    Cuenta de Instagram profesional conectada vía OAuth, con la página de
+    Facebook a la que está vinculada y sus tokens de larga duración.
+    Los tokens se guardan cifrados (ver mentions/tokens.py).
+    """
+
+    ig_user_id = models.CharField(max_length=64, unique=True)
+    username = models.CharField(max_length=255, blank=True)
+    biography = models.TextField(blank=True)
+    profile_picture_url = models.URLField(max_length=1000, blank=True)
+    page_id = models.CharField(max_length=64)
+    page_name = models.CharField(max_length=255, blank=True)
+    user_token = models.TextField()
+    page_token = models.TextField()
+    user_token_expires_at = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"@{self.username} ({self.page_name})"
+
+    @property
+    def profile(self):
+        """Resumen del perfil que se guarda en sesión para el dashboard."""
+        return {
+            "id": self.ig_user_id,
+            "username": self.username,
+            "biography": self.biography,
+            "profile_picture_url": self.profile_picture_url,
+        }
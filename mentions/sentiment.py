@@ -0,0 +1,479 @@
+"""
+Análisis de sentimiento multilenguaje (es / en / pt) para las menciones.
+
+El modelo es lineal sobre n-gramas (unigramas y bigramas) "hasheados", con
+marcado de negación ("no es bueno" -> NEG_bueno), y funciona sin conexión en
+CPU. Si no hay un modelo entrenado (ver `manage.py train_sentiment`), se usan
+pesos sembrados a partir del léxico de cada idioma.
+
+La inferencia se hace por lotes en un proceso aparte y los resultados se
+cachean por hash del texto. Si el proceso está saturado o tarda demasiado, se
+responde con el léxico simple para no bloquear el panel.
+"""
+import hashlib
+import json
+import logging
+import math
+import os
+import re
+import threading
+import unicodedata
+import zlib
+from concurrent.futures import ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+N_FEATURES = 2 ** 18
+NEGATION_SCOPE = 3  # tokens afectados después de un negador
+NEUTRAL_BAND = 0.1  # |p - 0.5| por debajo de esto se considera neutral
+SEED_WEIGHT = 1.0
+NEGATED_SEED_FACTOR = -0.75
+
+LANGUAGES = ("es", "en", "pt")
+DEFAULT_LANGUAGE = "es"
+
+# Palabras frecuentes para detectar el idioma (sin tildes)
+STOPWORDS = {
+    "es": {
+        "el", "la", "los", "las", "y", "es", "muy", "pero", "del", "una", "con",
+        "que", "por", "para", "como", "mas", "esta", "este", "gracias", "hoy",
+    },
+    "en": {
+        "the", "and", "is", "it", "you", "that", "for", "was", "on", "are",
+        "with", "this", "have", "not", "but", "my", "at", "very", "to", "of",
+    },
+    "pt": {
+        "o", "os", "e", "nao", "voce", "muito", "uma", "com", "do", "da", "em",
+        "que", "para", "mas", "foi", "isso", "esta", "obrigado", "obrigada", "ja",
+    },
+}
+
+NEGATORS = {
+    "es": {"no", "nunca", "ni", "jamas", "tampoco", "sin"},
+    "en": {"not", "no", "never", "nor", "without"},
+    "pt": {"nao", "nunca", "nem", "jamais", "sem"},
+}
+
+# Léxico base (sin tildes). Las frases de dos palabras se usan como bigramas.
+LEXICON = {
+    "es": {
+        "positive": [
+            "bueno", "buena", "buenos", "genial", "excelente", "maravilloso",
+            "gracias", "felicitaciones", "recomendado", "recomiendo", "me gusta",
+            "me encanta", "buenisimo", "increible", "feliz", "mejor", "perfecto",
+            "amable", "rapido", "funciona",
+        ],
+        "negative": [
+            "malo", "mala", "pesimo", "pesima", "horrible", "terrible", "queja",
+            "reclamo", "decepcion", "fraude", "estafa", "peor", "lento", "robo",
+            "mentira", "odio", "basura", "problema",
+        ],
+    },
+    "en": {
+        "positive": [
+            "good", "great", "excellent", "amazing", "awesome", "love", "thanks",
+            "thank", "recommend", "recommended", "happy", "best", "perfect",
+            "nice", "helpful", "fast", "works",
+        ],
+        "negative": [
+            "bad", "terrible", "horrible", "awful", "worst", "hate", "scam",
+            "fraud", "complaint", "disappointed", "disappointing", "slow",
+            "broken", "useless", "poor", "problem",
+        ],
+    },
+    "pt": {
+        "positive": [
+            "bom", "boa", "otimo", "otima", "excelente", "maravilhoso", "obrigado",
+            "obrigada", "parabens", "recomendo", "recomendado", "adoro", "amei",
+            "gosto", "feliz", "melhor", "perfeito", "incrivel", "rapido", "funciona",
+        ],
+        "negative": [
+            "ruim", "pessimo", "pessima", "horrivel", "terrivel", "reclamacao",
+            "decepcao", "fraude", "golpe", "pior", "lento", "odeio", "lixo",
+            "mentira", "problema",
+        ],
+    },
+}
+
+_TOKEN_RE = re.compile(r"\w+|[.!?,;:]")
+_PUNCTUATION = set(".!?,;:")
+
+
+def _normalize(text):
+    """Minúsculas y sin tildes, para que "pésimo" y "pesimo" coincidan."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    # "don't" -> "do not" para que el negador se detecte como token
+    return text.replace("n't", " not")
+
+
+def tokenize(text):
+    return _TOKEN_RE.findall(_normalize(text or ""))
+
+
+def detect_language(tokens):
+    """
+    Detecta es / en / pt contando palabras frecuentes de cada idioma.
+    En caso de empate devuelve DEFAULT_LANGUAGE.
+    """
+    counts = {lang: 0 for lang in LANGUAGES}
+    for tok in tokens:
+        for lang in LANGUAGES:
+            if tok in STOPWORDS[lang]:
+                counts[lang] += 1
+    best = max(LANGUAGES, key=lambda lang: counts[lang])
+    if counts[best] == 0 or list(counts.values()).count(counts[best]) > 1:
+        return DEFAULT_LANGUAGE
+    return best
+
+
+def _mark_negation(tokens, lang):
+    """
+    Antepone NEG_ a los tokens que siguen a un negador, hasta NEGATION_SCOPE
+    tokens o hasta el siguiente signo de puntuación.
+    """
+    negators = NEGATORS[lang]
+    marked = []
+    remaining = 0
+    for tok in tokens:
+        if tok in _PUNCTUATION:
+            remaining = 0
+            marked.append(tok)
+        elif tok in negators:
+            remaining = NEGATION_SCOPE
+            marked.append(tok)
+        elif remaining:
+            remaining -= 1
+            marked.append("NEG_" + tok)
+        else:
+            marked.append(tok)
+    return [tok for tok in marked if tok not in _PUNCTUATION]
+
+
+def _hash_feature(name, n_features=N_FEATURES):
+    # crc32 es estable entre procesos (a diferencia de hash())
+    return zlib.crc32(name.encode("utf-8")) % n_features
+
+
+def extract_features(text, lang=None, n_features=N_FEATURES):
+    """
+    Devuelve (lang, índices de features) para el texto: unigramas y bigramas
+    con negación marcada, prefijados por idioma.
+    """
+    tokens = tokenize(text)
+    if lang not in LANGUAGES:
+        lang = detect_language(tokens)
+    tokens = _mark_negation(tokens, lang)
+
+    features = [_hash_feature(f"{lang}|u|{tok}", n_features) for tok in tokens]
+    features.extend(
+        _hash_feature(f"{lang}|b|{a} {b}", n_features)
+        for a, b in zip(tokens, tokens[1:])
+    )
+    return lang, features
+
+
+def _sigmoid(x):
+    if x >= 0:
+        return 1.0 / (1.0 + math.exp(-x))
+    z = math.exp(x)
+    return z / (1.0 + z)
+
+
+class HashedLinearModel:
+    """
+    Regresión logística sobre features hasheadas (pesos dispersos en un dict).
+    p(positive) = sigmoid(bias + suma de pesos); cerca de 0.5 es neutral.
+    """
+
+    def __init__(self, weights=None, bias=0.0, n_features=N_FEATURES):
+        self.weights = weights or {}
+        self.bias = bias
+        self.n_features = n_features
+
+    @classmethod
+    def from_lexicon(cls):
+        """Pesos iniciales a partir de LEXICON, incluidas sus formas negadas."""
+        model = cls()
+        for lang, groups in LEXICON.items():
+            for polarity, terms in groups.items():
+                weight = SEED_WEIGHT if polarity == "positive" else -SEED_WEIGHT
+                for term in terms:
+                    words = term.split()
+                    kind = "b" if len(words) == 2 else "u"
+                    negated = " ".join("NEG_" + w for w in words)
+                    for name, w in (
+                        (f"{lang}|{kind}|{term}", weight),
+                        (f"{lang}|{kind}|{negated}", weight * NEGATED_SEED_FACTOR),
+                    ):
+                        idx = _hash_feature(name, model.n_features)
+                        model.weights[idx] = model.weights.get(idx, 0.0) + w
+        return model
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as fh:
+            data = json.load(fh)
+        return cls(
+            weights={int(k): float(v) for k, v in data["weights"].items()},
+            bias=float(data.get("bias", 0.0)),
+            n_features=int(data.get("n_features", N_FEATURES)),
+        )
+
+    def save(self, path):
+        data = {
+            "n_features": self.n_features,
+            "bias": self.bias,
+            "weights": {str(k): round(v, 6) for k, v in self.weights.items() if v},
+        }
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh)
+
+    def probability(self, features):
+        return _sigmoid(self.bias + sum(self.weights.get(f, 0.0) for f in features))
+
+    def partial_fit(self, features, target, lr=0.1, l2=1e-6):
+        """Un paso de SGD con pérdida logística; target en [0, 1]."""
+        grad = self.probability(features) - target
+        self.bias -= lr * grad
+        for f in features:
+            w = self.weights.get(f, 0.0)
+            self.weights[f] = w - lr * (grad + l2 * w)
+
+    def predict(self, text, lang=None):
+        lang, features = extract_features(text, lang, self.n_features)
+        p = self.probability(features)
+        if p >= 0.5 + NEUTRAL_BAND:
+            label = "positive"
+        elif p <= 0.5 - NEUTRAL_BAND:
+            label = "negative"
+        else:
+            label = "neutral"
+        return {"label": label, "score": round(abs(2 * p - 1), 3), "lang": lang}
+
+
+def lexicon_sentiment(text, lang=None):
+    """
+    Análisis de sentimiento simple basado en palabras clave del idioma.
+    Es el respaldo barato cuando el modelo no está disponible a tiempo.
+    Devuelve un dict con label: positive|neutral|negative, score (0..1) y lang.
+    """
+    tokens = tokenize(text)
+    if lang not in LANGUAGES:
+        lang = detect_language(tokens)
+    tokens = _mark_negation(tokens, lang)
+    if not tokens:
+        return {"label": "neutral", "score": 0.0, "lang": lang}
+
+    def hits(terms, negated):
+        # Con negated=True se buscan las formas negadas ("no me gusta" -> NEG_me NEG_gusta)
+        return sum(
+            1
+            for term in terms
+            if " " + " ".join(("NEG_" + w) if negated else w for w in term.split()) + " "
+            in text_l
+        )
+
+    text_l = " " + " ".join(tokens) + " "
+    positive, negative = LEXICON[lang]["positive"], LEXICON[lang]["negative"]
+    pos_count = hits(positive, False) + hits(negative, True)
+    neg_count = hits(negative, False) + hits(positive, True)
+
+    if pos_count > neg_count:
+        label = "positive"
+        score = min(1.0, pos_count / (pos_count + neg_count or 1))
+    elif neg_count > pos_count:
+        label = "negative"
+        score = min(1.0, neg_count / (pos_count + neg_count or 1))
+    else:
+        label = "neutral"
+        score = 0.0
+
+    return {"label": label, "score": score, "lang": lang}
+
+
+# --- Servicio de inferencia por lotes ---
+
+_model = None  # modelo cargado en este proceso (worker o servidor)
+_model_tag = None  # versión de _model, ver _model_version
+_executor = None
+_executor_lock = threading.Lock()
+_pending = 0
+_missing_model_warned = False
+
+
+def _model_version():
+    """
+    Devuelve (ruta del modelo o None, etiqueta de versión). La etiqueta cambia
+    al reentrenar sobre la misma ruta (mtime y tamaño), así se invalidan la
+    caché y el modelo cargado en los workers. Si SENTIMENT_MODEL_PATH no
+    existe se usa el léxico base.
+    """
+    global _missing_model_warned
+    path = getattr(settings, "SENTIMENT_MODEL_PATH", None)
+    if path:
+        try:
+            stat = os.stat(path)
+        except OSError:
+            if not _missing_model_warned:
+                logger.warning(
+                    "SENTIMENT_MODEL_PATH=%s no existe; se usan los pesos del léxico base.", path
+                )
+                _missing_model_warned = True
+        else:
+            return path, f"{stat.st_mtime_ns}-{stat.st_size}"
+    return None, "lexicon"
+
+
+def _get_model(path, tag):
+    """Carga el modelo en este proceso si no está cargado o cambió su versión."""
+    global _model, _model_tag
+    if _model is None or _model_tag != tag:
+        _model = HashedLinearModel.load(path) if path else HashedLinearModel.from_lexicon()
+        _model_tag = tag
+    return _model
+
+
+def _predict_batch(items, model_path, model_tag):
+    """Se ejecuta en el worker: items es una lista de (texto, lang)."""
+    model = _get_model(model_path, model_tag)
+    return [model.predict(text, lang) for text, lang in items]
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ProcessPoolExecutor(
+                max_workers=getattr(settings, "SENTIMENT_WORKERS", 1),
+            )
+        return _executor
+
+
+def _reset_executor():
+    global _executor, _pending
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _pending = 0
+
+
+def _cache_key(text, lang, version):
+    path, tag = version
+    model_tag = hashlib.sha1(f"{path}:{tag}".encode("utf-8")).hexdigest()[:12]
+    text_hash = hashlib.sha1(text.encode("utf-8")).hexdigest()
+    return f"sentiment:v2:{model_tag}:{lang or 'auto'}:{text_hash}"
+
+
+def _submit(items, keys, version):
+    """
+    Envía un lote al worker. Al terminar (aunque sea tarde) el resultado se
+    guarda en caché, así la próxima consulta ya no cae en el léxico.
+    """
+    global _pending
+    ttl = getattr(settings, "SENTIMENT_CACHE_TTL", 7 * 24 * 3600)
+    future = _get_executor().submit(_predict_batch, items, *version)
+    with _executor_lock:
+        _pending += 1
+
+    def _on_done(f):
+        global _pending
+        with _executor_lock:
+            _pending = max(0, _pending - 1)
+        if not f.cancelled() and f.exception() is None:
+            cache.set_many(dict(zip(keys, f.result())), ttl)
+
+    future.add_done_callback(_on_done)
+    return future
+
+
+def analyze_batch(texts, langs=None):
+    """
+    Analiza una lista de textos y devuelve un dict por texto con
+    label (positive|neutral|negative), score (0..1) y lang.
+
+    `langs` permite pasar el idioma conocido de cada texto (p. ej. el campo
+    `lang` de X); si es None o desconocido se detecta automáticamente.
+    """
+    langs = langs or [None] * len(texts)
+    results = [None] * len(texts)
+    version = _model_version()
+
+    # Agrupar por clave de caché: los textos repetidos se analizan una vez
+    positions = {}
+    for i, text in enumerate(texts):
+        if not text:
+            results[i] = {"label": "neutral", "score": 0.0, "lang": langs[i] or DEFAULT_LANGUAGE}
+            continue
+        positions.setdefault(_cache_key(text, langs[i], version), []).append(i)
+
+    cached = cache.get_many(list(positions)) if positions else {}
+    missing = []
+    for key, idxs in positions.items():
+        if key in cached:
+            for i in idxs:
+                results[i] = cached[key]
+        else:
+            missing.append(key)
+
+    if not missing:
+        return results
+
+    items = [(texts[positions[k][0]], langs[positions[k][0]]) for k in missing]
+    predictions = _run_model(items, missing, version)
+    for key, item, prediction in zip(missing, items, predictions):
+        if prediction is None:
+            prediction = lexicon_sentiment(*item)
+        for i in positions[key]:
+            results[i] = prediction
+    return results
+
+
+def _run_model(items, keys, version):
+    """
+    Devuelve una predicción por item, o None en los que no hubo respuesta del
+    modelo a tiempo (el llamador usa entonces el léxico).
+    """
+    workers = getattr(settings, "SENTIMENT_WORKERS", 1)
+    batch_size = getattr(settings, "SENTIMENT_BATCH_SIZE", 256)
+    ttl = getattr(settings, "SENTIMENT_CACHE_TTL", 7 * 24 * 3600)
+
+    if workers <= 0:
+        # Sin proceso aparte: inferencia en el mismo proceso
+        predictions = _predict_batch(items, *version)
+        cache.set_many(dict(zip(keys, predictions)), ttl)
+        return predictions
+
+    # Bajo carga no encolamos más trabajo: respuesta inmediata con el léxico
+    if _pending >= getattr(settings, "SENTIMENT_MAX_PENDING", 8):
+        return [None] * len(items)
+
+    try:
+        futures = [
+            _submit(items[i:i + batch_size], keys[i:i + batch_size], version)
+            for i in range(0, len(items), batch_size)
+        ]
+    except (BrokenProcessPool, RuntimeError, OSError):
+        _reset_executor()
+        return [None] * len(items)
+
+    wait(futures, timeout=getattr(settings, "SENTIMENT_TIMEOUT", 2.0))
+
+    predictions = []
+    for i, future in enumerate(futures):
+        size = len(items[i * batch_size:(i + 1) * batch_size])
+        # Un lote cancelado (otra petición reinició el pool) va al léxico;
+        # exception() lanzaría CancelledError sobre él
+        if not future.done() or future.cancelled():
+            predictions.extend([None] * size)
+        elif future.exception() is None:
+            predictions.extend(future.result())
+        else:
+            if isinstance(future.exception(), BrokenProcessPool):
+                _reset_executor()
+            predictions.extend([None] * size)
+    return predictions
@@ -0,0 +1,74 @@
+import random
+from datetime import datetime, timezone
+
+from django.test import SimpleTestCase
+
+from mentions.alerts import AlertEvaluator
+
+START = 1_700_000_040  # múltiplo de 60: cada minuto cae en su propio bucket
+
+
+class NegativeSpikeTests(SimpleTestCase):
+    """Reproduce un flujo sintético minuto a minuto a través de consume()."""
+
+    def setUp(self):
+        self.evaluator = AlertEvaluator()
+        self.rng = random.Random(0)
+        self.minute = 0
+        self.next_id = 0
+
+    def _mentions(self, network, per_minute, negative_rate, now):
+        created = datetime.fromtimestamp(now, tz=timezone.utc).isoformat()
+        mentions = []
+        for _ in range(per_minute):
+            self.next_id += 1
+            label = "negative" if self.rng.random() < negative_rate else "positive"
+            mentions.append(
+                {
+                    "id": str(self.next_id),
+                    "network": network,
+                    "created_time": created,
+                    "sentiment": {"label": label},
+                }
+            )
+        return mentions
+
+    def play(self, minutes, rates, per_minute=10):
+        """
+        Avanza `minutes` minutos con `per_minute` menciones por red y la tasa
+        de negativas indicada en `rates` ({red: tasa}). Devuelve las alertas
+        negative_spike como (minuto relativo, red).
+        """
+        fired = []
+        for i in range(minutes):
+            now = START + self.minute * 60 + 30
+            mentions = []
+            for network, rate in rates.items():
+                mentions.extend(self._mentions(network, per_minute, rate, now))
+            for alert in self.evaluator.consume(mentions, now=now):
+                if alert["kind"] == "negative_spike":
+                    fired.append((i, alert["network"]))
+            self.minute += 1
+        return fired
+
+    def test_quiet_baseline_does_not_fire(self):
+        self.assertEqual(self.play(120, {"facebook": 0.1}), [])
+
+    def test_step_fires_quickly(self):
+        for before, after in ((0.1, 0.5), (0.2, 0.9), (0.2, 0.8)):
+            with self.subTest(before=before, after=after):
+                self.setUp()
+                self.assertEqual(self.play(120, {"facebook": before}), [])
+                fired = self.play(60, {"facebook": after})
+                self.assertTrue(fired, f"no saltó la alerta con {before:.0%} -> {after:.0%}")
+                self.assertLessEqual(fired[0][0], 3)
+
+    def test_step_held_for_window_fires_once(self):
+        self.play(120, {"facebook": 0.2})
+        fired = self.play(15, {"facebook": 0.8})
+        self.assertEqual(len(fired), 1)
+
+    def test_single_network_spike_is_not_duplicated_in_all(self):
+        self.play(120, {"facebook": 0.1, "x": 0.1})
+        fired = self.play(15, {"facebook": 0.7, "x": 0.1})
+        self.assertEqual([network for _, network in fired], ["facebook"])
@@ -0,0 +1,232 @@
+"""
+Ciclo de vida de los tokens de Meta para la cuenta de Instagram conectada.
+
+- Intercambia el `code` de OAuth por un token de usuario y este por uno de
+  larga duración (~60 días).
+- Resuelve en una sola petición (`?ids=`) qué página tiene una cuenta de
+  Instagram profesional, con el perfil incluido.
+- Guarda tokens y mapeo página -> cuenta de IG en ConnectedAccount, con los
+  tokens cifrados (Fernet).
+- Renueva el token de usuario antes de que caduque (TOKEN_REFRESH_MARGIN).
+"""
+import base64
+import hashlib
+import logging
+from datetime import timedelta
+
+import requests
+from cryptography.fernet import Fernet, InvalidToken
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ConnectedAccount
+
+logger = logging.getLogger(__name__)
+
+GRAPH_API_BASE = "https://graph.facebook.com/v21.0"
+IG_PROFILE_FIELDS = "id,username,biography,profile_picture_url"
+
+
+class MetaTokenError(Exception):
+    """Error al obtener o renovar tokens de Meta."""
+
+
+# --- Cifrado ---
+
+def _fernet():
+    """
+    Usa TOKEN_ENCRYPTION_KEY (clave Fernet) si está definida; si no, deriva
+    una a partir de SECRET_KEY.
+    """
+    key = getattr(settings, "TOKEN_ENCRYPTION_KEY", None)
+    if not key:
+        digest = hashlib.sha256(settings.SECRET_KEY.encode("utf-8")).digest()
+        key = base64.urlsafe_b64encode(digest)
+    return Fernet(key)
+
+
+def encrypt_token(token):
+    return _fernet().encrypt(token.encode("utf-8")).decode("ascii")
+
+
+def decrypt_token(value):
+    try:
+        return _fernet().decrypt(value.encode("ascii")).decode("utf-8")
+    except InvalidToken:
+        raise MetaTokenError("No se pudo descifrar el token guardado (¿cambió la clave?).")
+
+
+# --- Llamadas a la Graph API ---
+
+def _graph_get(path, params):
+    try:
+        resp = requests.get(f"{GRAPH_API_BASE}/{path}", params=params, timeout=15)
+        data = resp.json()
+    except (requests.RequestException, ValueError) as e:
+        raise MetaTokenError(f"Error al llamar a /{path}: {e}")
+    if "error" in data:
+        err = data["error"]
+        raise MetaTokenError(f"/{path}: {err.get('message', '')} (code {err.get('code')})")
+    return data
+
+
+def _expires_at(token_data):
+    expires_in = token_data.get("expires_in")
+    if not expires_in:
+        return None
+    return timezone.now() + timedelta(seconds=int(expires_in))
+
+
+def exchange_code(code, redirect_uri):
+    """Intercambia el `code` de OAuth por un token de usuario de corta duración."""
+    data = _graph_get(
+        "oauth/access_token",
+        {
+            "client_id": settings.META_APP_ID,
+            "redirect_uri": redirect_uri,
+            "client_secret": settings.META_APP_SECRET,
+            "code": code,
+        },
+    )
+    if not data.get("access_token"):
+        raise MetaTokenError(f"Respuesta inesperada al obtener access_token: {data}")
+    return data["access_token"]
+
+
+def exchange_long_lived(user_token):
+    """
+    Cambia un token de usuario por uno de larga duración.
+    Devuelve (token, fecha de expiración o None).
+    """
+    data = _graph_get(
+        "oauth/access_token",
+        {
+            "grant_type": "fb_exchange_token",
+            "client_id": settings.META_APP_ID,
+            "client_secret": settings.META_APP_SECRET,
+            "fb_exchange_token": user_token,
+        },
+    )
+    if not data.get("access_token"):
+        raise MetaTokenError(f"Respuesta inesperada al renovar el token: {data}")
+    return data["access_token"], _expires_at(data)
+
+
+def resolve_instagram_page(user_token):
+    """
+    Busca la primera página administrada con una cuenta de Instagram
+    profesional conectada. Hace dos peticiones en total: /me/accounts (con el
+    token de cada página) y una consulta agrupada `?ids=` con el detalle de
+    todas las páginas y el perfil de IG expandido.
+    Devuelve (página de /me/accounts, perfil de IG) o (None, None).
+    """
+    pages = _graph_get(
+        "me/accounts",
+        {"access_token": user_token, "fields": "id,name,access_token", "limit": 100},
+    ).get("data", [])
+    page_ids = [p["id"] for p in pages if p.get("id")]
+    if not page_ids:
+        return None, None
+
+    details = _graph_get(
+        "",
+        {
+            "access_token": user_token,
+            "ids": ",".join(page_ids),
+            "fields": f"name,connected_instagram_account{{{IG_PROFILE_FIELDS}}}",
+        },
+    )
+    # Respetar el orden de /me/accounts
+    for page in pages:
+        ig_account = (details.get(page.get("id")) or {}).get("connected_instagram_account")
+        if ig_account and ig_account.get("id"):
+            return page, ig_account
+    return None, None
+
+
+# --- Persistencia ---
+
+def connect_account(code, redirect_uri):
+    """
+    Flujo completo del callback de OAuth: code -> token de larga duración ->
+    página e IG -> ConnectedAccount guardada. Devuelve la cuenta o None si
+    ninguna página tiene Instagram profesional conectado.
+    """
+    short_token = exchange_code(code, redirect_uri)
+    user_token, expires_at = exchange_long_lived(short_token)
+    page, ig_account = resolve_instagram_page(user_token)
+    if not ig_account:
+        return None
+
+    # El token de página obtenido con un token de usuario de larga duración no caduca
+    account, _ = ConnectedAccount.objects.update_or_create(
+        ig_user_id=ig_account["id"],
+        defaults={
+            "username": ig_account.get("username") or "",
+            "biography": ig_account.get("biography") or "",
+            "profile_picture_url": ig_account.get("profile_picture_url") or "",
+            "page_id": page["id"],
+            "page_name": page.get("name") or "",
+            "user_token": encrypt_token(user_token),
+            "page_token": encrypt_token(page.get("access_token") or user_token),
+            "user_token_expires_at": expires_at,
+        },
+    )
+    return account
+
+
+def refresh_account(account):
+    """Renueva el token de usuario y el de la página de la cuenta."""
+    user_token, expires_at = exchange_long_lived(decrypt_token(account.user_token))
+    page = _graph_get(account.page_id, {"access_token": user_token, "fields": "access_token"})
+    account.user_token = encrypt_token(user_token)
+    account.page_token = encrypt_token(page.get("access_token") or user_token)
+    account.user_token_expires_at = expires_at
+    account.save(update_fields=["user_token", "page_token", "user_token_expires_at", "updated_at"])
+    return account
+
+
+def _needs_refresh(account):
+    if account.user_token_expires_at is None:
+        return False
+    margin = timedelta(seconds=getattr(settings, "TOKEN_REFRESH_MARGIN", 7 * 24 * 3600))
+    return account.user_token_expires_at - timezone.now() < margin
+
+
+def is_valid(account):
+    return account.user_token_expires_at is None or account.user_token_expires_at > timezone.now()
+
+
+def get_account(ig_user_id=None):
+    """
+    Devuelve la cuenta indicada (o la conectada más recientemente), renovando
+    su token si está cerca de caducar. None si no hay cuenta válida.
+    """
+    accounts = ConnectedAccount.objects.order_by("-updated_at")
+    if ig_user_id:
+        accounts = accounts.filter(ig_user_id=ig_user_id)
+    account = accounts.first()
+    if account is None:
+        return None
+
+    if _needs_refresh(account):
+        try:
+            refresh_account(account)
+        except MetaTokenError as e:
+            # Si falla seguimos con el token actual mientras no haya caducado
+            logger.warning("No se pudo renovar el token de @%s: %s", account.username, e)
+    return account if is_valid(account) else None
+
+
+def refresh_expiring_accounts():
+    """Renueva todas las cuentas cuyo token caduca dentro del margen."""
+    refreshed = 0
+    for account in ConnectedAccount.objects.all():
+        if not _needs_refresh(account) or not is_valid(account):
+            continue
+        try:
+            refresh_account(account)
+            refreshed += 1
+        except MetaTokenError as e:
+            logger.warning("No se pudo renovar el token de @%s: %s", account.username, e)
+    return refreshed
@@ -1,13 +1,23 @@
 import os
+import base64
+import json
+import logging
 import requests
 from requests.exceptions import ReadTimeout, RequestException
 from django.conf import settings
+from django.core.cache import cache
 from django.http import JsonResponse, HttpResponseServerError, HttpResponse
 import urllib.parse
 from django.shortcuts import render, redirect
+from django.utils.cache import patch_cache_control
 from datetime import datetime, timezone
 import math
 
+from . import alerts, sentiment, tokens
+from .models import ConnectedAccount
+
+logger = logging.getLogger(__name__)
+
 GRAPH_API_BASE = "https://graph.facebook.com/v21.0"
 X_API_BASE = getattr(settings, "X_API_BASE", "https://api.x.com/2")
 
@@ -44,12 +54,28 @@ def _fetch_tagged_posts(limit=10):
     return data.get("data", [])
 
 
-def _fetch_instagram_tagged(limit=50):
+def _fetch_instagram_tagged(limit=50, connected_ig_user_id=None):
+    """
+    Obtiene publicaciones de Instagram donde la cuenta ha sido etiquetada.
+    Usa IG_USER_ID y FB_PAGE_ACCESS_TOKEN de settings o, si no están, la
+    cuenta conectada por OAuth indicada en connected_ig_user_id.
+    """
     ig_user_id = getattr(settings, "IG_USER_ID", None)
     access_token = getattr(settings, "FB_PAGE_ACCESS_TOKEN", None)
 
     if not ig_user_id or not access_token:
-        return []
+        if not connected_ig_user_id:
+            return []
+        # Cuenta conectada por OAuth (token ya resuelto); si no es usable, IG no disponible
+        try:
+            account = tokens.get_account(connected_ig_user_id)
+            if account is None:
+                return []
+            access_token = tokens.decrypt_token(account.page_token)
+        except tokens.MetaTokenError as e:
+            logger.warning("Instagram no disponible: %s", e)
+            return []
+        ig_user_id = account.ig_user_id
 
     url = f"{GRAPH_API_BASE}/{ig_user_id}/tags"
     params = {
@@ -101,9 +127,17 @@ def _fetch_x_mentions(limit=50, timeout=10):
         "Authorization": f"Bearer {bearer}",
     }
 
+    # Idiomas a incluir (X_LANGS), p. ej. "es,en,pt"; vacío para no filtrar
+    langs = [l.strip() for l in getattr(settings, "X_LANGS", "es").split(",") if l.strip()]
+    query = f"@{username} -is:retweet"
+    if len(langs) == 1:
+        query += f" lang:{langs[0]}"
+    elif langs:
+        query += " (" + " OR ".join(f"lang:{l}" for l in langs) + ")"
+
     params = {
-        # menciones al usuario, sin retuits, en español
-        "query": f"@{username} -is:retweet lang:es",
+        # menciones al usuario, sin retuits, en los idiomas configurados
+        "query": query,
         "tweet.fields": "author_id,created_at,lang,public_metrics",
         "expansions": "author_id",
         "user.fields": "name,username",
@@ -127,12 +161,6 @@ def _fetch_x_mentions(limit=50, timeout=10):
         text = t.get("text") or ""
         created_at = t.get("created_at")
 
-        sentiment = _analyze_sentiment(text)
-        impact = _compute_impact({
-            "message": text,
-            "created_time": created_at,
-        })
-
         username_x = user.get("username")
         permalink = None
         if username_x:
@@ -146,63 +174,11 @@ def _fetch_x_mentions(limit=50, timeout=10):
             "message": text,
             "created_time": created_at,
             "permalink_url": permalink,
-            "sentiment": sentiment,
-            "stats": impact,
+            "lang": t.get("lang"),
         })
 
     return results
 
-def _analyze_sentiment(text):
-    """
-    Análisis de sentimiento muy sencillo basado en palabras clave.
-    Devuelve un dict con label: positive|neutral|negative y score (0..1).
-    """
-    if not text:
-        return {"label": "neutral", "score": 0.0}
-
-    text_l = text.lower()
-
-    positive_words = [
-        "bueno",
-        "genial",
-        "excelente",
-        "maravilloso",
-        "gracias",
-        "felicitaciones",
-        "recomendado",
-        "me gusta",
-        "buenísimo",
-        "increíble",
-    ]
-    negative_words = [
-        "malo",
-        "pésimo",
-        "horrible",
-        "terrible",
-        "queja",
-        "reclamo",
-        "no me gusta",
-        "decepción",
-        "fraude",
-        "estafa",
-    ]
-
-    pos_count = sum(1 for w in positive_words if w in text_l)
-    neg_count = sum(1 for w in negative_words if w in text_l)
-
-    if pos_count > neg_count:
-        label = "positive"
-        score = min(1.0, pos_count / (pos_count + neg_count or 1))
-    elif neg_count > pos_count:
-        label = "negative"
-        score = min(1.0, neg_count / (pos_count + neg_count or 1))
-    else:
-        label = "neutral"
-        score = 0.0
-
-    return {"label": label, "score": score}
-
-
 def _compute_impact(post_dict):
     """
     Cálculo heurístico de impacto basado en longitud del mensaje y recencia.
@@ -241,61 +217,33 @@ def _compute_impact(post_dict):
         "impact_score": impact_score,
         "impact_level": level,
     }
-def mentions_api(request):
+def _collect_mentions(network_filter, ig_user_id=None):
     """
-    API de menciones con filtrado, orden y paginación en el servidor.
-
-    Parámetros de query opcionales:
-      - sentiment: all | positive | neutral | negative
-      - search: texto libre para buscar en message / from_name
-      - sort_field: created_time | from_name | sentiment | impact
-      - sort_dir: asc | desc
-      - page: número de página (1-based)
-      - page_size: tamaño de página (por defecto 10)
-      - network: all | facebook | instagram | x
+    Consulta las redes indicadas por network_filter y devuelve la lista de
+    menciones normalizadas, con sentimiento e impacto ya calculados.
+    ig_user_id es la cuenta de Instagram conectada por OAuth, si la hay.
+    Las excepciones de las APIs se propagan para que mentions_api las reporte.
     """
-    # Filtro por red: all | facebook | instagram | x
-    network_filter = request.GET.get("network", "all")
-    if network_filter not in ("all", "facebook", "instagram", "x"):
-        network_filter = "all"
+    raw_sources = []
 
-    # Obtener posts de Facebook, Instagram y X según el filtro de red
-    try:
-        raw_sources = []
+    if network_filter in ("all", "facebook"):
+        fb_posts = _fetch_tagged_posts(limit=39)
+        raw_sources.extend([("facebook", p) for p in fb_posts])
 
-        if network_filter in ("all", "facebook"):
-            fb_posts = _fetch_tagged_posts(limit=39)
-            raw_sources.extend([("facebook", p) for p in fb_posts])
+    if network_filter in ("all", "instagram"):
+        ig_posts = _fetch_instagram_tagged(limit=39, connected_ig_user_id=ig_user_id)
+        raw_sources.extend([("instagram", p) for p in ig_posts])
 
-        if network_filter in ("all", "instagram"):
-            ig_posts = _fetch_instagram_tagged(limit=39)
-            raw_sources.extend([("instagram", p) for p in ig_posts])
-
-        if network_filter in ("all", "x"):
-            x_posts = _fetch_x_mentions(limit=39)
-            raw_sources.extend([("x", p) for p in x_posts])
-
-    except ReadTimeout as e:
-        return JsonResponse(
-            {
-                "error": "Error al consultar la API de Facebook",
-                "detail": f"Tiempo de espera agotado al llamar a Facebook/Instagram: {e}",
-            },
-            status=504,
-        )
-    except Exception as e:
-        return JsonResponse(
-            {
-                "error": "Error al consultar la API de Facebook/Instagram",
-                "detail": str(e),
-            },
-            status=500,
-        )
+    if network_filter in ("all", "x"):
+        x_posts = _fetch_x_mentions(limit=39)
+        raw_sources.extend([("x", p) for p in x_posts])
 
     mentions = []
+    langs = []
 
     # Normalizar estructura de menciones y calcular impacto
     for source, p in raw_sources:
+        lang = None
         if source == "facebook":
             message = p.get("message")
             created_time = p.get("created_time")
@@ -316,6 +264,7 @@ def mentions_api(request):
             permalink_url = p.get("permalink_url", "")
             from_name = p.get("from_name", "")
             from_id = p.get("from_id", "")
+            lang = p.get("lang")
         else:
             # Cualquier otra red futura
             message = p.get("message")
@@ -324,7 +273,7 @@ def mentions_api(request):
             from_name = p.get("from_name", "")
             from_id = p.get("from_id", "")
 
-        sentiment = _analyze_sentiment(message)
+        langs.append(lang)
         stats = _compute_impact(
             {
                 "message": message,
@@ -341,11 +290,121 @@ def mentions_api(request):
                 "message": message,
                 "created_time": created_time,
                 "permalink_url": permalink_url,
-                "sentiment": sentiment,
                 "stats": stats,
             }
         )
 
+    # Sentimiento en un solo lote (con caché por texto y respaldo por léxico)
+    sentiments = sentiment.analyze_batch([m["message"] for m in mentions], langs)
+    for m, result in zip(mentions, sentiments):
+        m["sentiment"] = result
+
+    return mentions
+
+
+def _mentions_cache_key(network_filter, ig_user_id=None):
+    return f"mentions:v1:{network_filter}:{ig_user_id or '-'}"
+
+
+def _invalidate_mentions_cache(ig_user_id):
+    """Descarta las menciones cacheadas que dependen de la cuenta de Instagram."""
+    cache.delete_many(
+        [_mentions_cache_key(n, ig_user_id) for n in ("all", "instagram")]
+    )
+
+
+def _get_mentions(network_filter, ig_user_id=None):
+    """
+    Devuelve las menciones normalizadas para network_filter usando la caché de
+    Django durante MENTIONS_CACHE_TTL segundos. Así, cambiar de página, de orden
+    o de filtro de sentimiento/búsqueda no vuelve a llamar a las APIs externas.
+    Los errores no se cachean.
+    """
+    ttl = getattr(settings, "MENTIONS_CACHE_TTL", 60)
+    cache_key = _mentions_cache_key(network_filter, ig_user_id)
+    mentions = cache.get(cache_key) if ttl > 0 else None
+    if mentions is None:
+        mentions = _collect_mentions(network_filter, ig_user_id)
+        if ttl > 0:
+            cache.set(cache_key, mentions, ttl)
+        # Evaluar alertas sobre las menciones nuevas, salvo que las evalúe
+        # watch_mentions (MENTIONS_ALERTS_ENABLED=False en el servidor web)
+        if getattr(settings, "MENTIONS_ALERTS_ENABLED", True):
+            alerts.process(mentions)
+    return mentions
+
+
+def _encode_cursor(sort_field, key):
+    """
+    Codifica la clave de orden de la última mención devuelta como un token
+    opaco para el parámetro `after` de mentions_api.
+    """
+    payload = json.dumps({"f": sort_field, "k": list(key)}, separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _decode_cursor(token, sort_field):
+    """
+    Decodifica un token de _encode_cursor. Devuelve la clave de orden como
+    tupla, o None si el token es inválido o se generó con otro sort_field.
+    """
+    try:
+        padded = token + "=" * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+        value, mention_id = payload["k"]
+    except (ValueError, TypeError, KeyError):
+        return None
+    if payload.get("f") != sort_field or not isinstance(mention_id, str):
+        return None
+    if isinstance(value, bool) or not isinstance(value, (str, int, float)):
+        return None
+    # created_time y from_name se ordenan como texto; sentiment e impact como número
+    if isinstance(value, str) == (sort_field in ("sentiment", "impact")):
+        return None
+    return (value, mention_id)
+
+
+def mentions_api(request):
+    """
+    API de menciones con filtrado, orden y paginación en el servidor.
+
+    Parámetros de query opcionales:
+      - sentiment: all | positive | neutral | negative
+      - search: texto libre para buscar en message / from_name
+      - sort_field: created_time | from_name | sentiment | impact
+      - sort_dir: asc | desc
+      - page: número de página (1-based)
+      - page_size: tamaño de página (por defecto 10)
+      - network: all | facebook | instagram | x
+      - after: cursor para scroll infinito (vacío para la primera página).
+        Si está presente se ignora `page` y la respuesta incluye
+        `pagination.next_after` y `pagination.has_more`.
+    """
+    # Filtro por red: all | facebook | instagram | x
+    network_filter = request.GET.get("network", "all")
+    if network_filter not in ("all", "facebook", "instagram", "x"):
+        network_filter = "all"
+
+    # Obtener menciones de Facebook, Instagram y X según el filtro de red
+    try:
+        mentions = _get_mentions(network_filter, request.session.get("ig_user_id"))
+    except ReadTimeout as e:
+        return JsonResponse(
+            {
+                "error": "Error al consultar la API de Facebook",
+                "detail": f"Tiempo de espera agotado al llamar a Facebook/Instagram: {e}",
+            },
+            status=504,
+        )
+    except Exception as e:
+        return JsonResponse(
+            {
+                "error": "Error al consultar la API de Facebook/Instagram",
+                "detail": str(e),
+            },
+            status=500,
+        )
+
     # Parámetros de filtrado/orden/paginación
     sentiment_filter = request.GET.get("sentiment", "all")
     search_q = (request.GET.get("search") or "").strip().lower()
@@ -399,8 +458,63 @@ def mentions_api(request):
             return float(m.get("stats", {}).get("impact_score") or 0.0)
         return m.get("created_time") or ""
 
+    def full_sort_key(m):
+        # El id desempata para que el orden sea total y los cursores estables
+        return (sort_key(m), str(m.get("id") or ""))
+
     reverse = sort_dir == "desc"
-    filtered.sort(key=sort_key, reverse=reverse)
+    filtered.sort(key=full_sort_key, reverse=reverse)
+
+    summary = {
+        "total_mentions": len(filtered),
+        "positive": positive_count,
+        "neutral": neutral_count,
+        "negative": negative_count,
+    }
+
+    # Paginación por cursor (scroll infinito): ?after=<token>, vacío para empezar
+    if "after" in request.GET:
+        after = request.GET.get("after") or ""
+        start = 0
+        if after:
+            cursor_key = _decode_cursor(after, sort_field)
+            if cursor_key is None:
+                return JsonResponse(
+                    {
+                        "error": "Cursor inválido",
+                        "detail": "El parámetro 'after' no corresponde al orden solicitado.",
+                    },
+                    status=400,
+                )
+            start = len(filtered)
+            for i, m in enumerate(filtered):
+                key = full_sort_key(m)
+                if (key < cursor_key) if reverse else (key > cursor_key):
+                    start = i
+                    break
+
+        page_items = filtered[start:start + page_size]
+        has_more = start + page_size < len(filtered)
+        next_after = None
+        if has_more and page_items:
+            next_after = _encode_cursor(sort_field, full_sort_key(page_items[-1]))
+
+        response = JsonResponse(
+            {
+                "mentions": page_items,
+                "summary": summary,
+                "pagination": {
+                    "page_size": page_size,
+                    "total_items": len(filtered),
+                    "has_more": has_more,
+                    "next_after": next_after,
+                },
+            }
+        )
+        patch_cache_control(
+            response, private=True, max_age=getattr(settings, "MENTIONS_CACHE_TTL", 60)
+        )
+        return response
 
     # Paginación
     total_items = len(filtered)
@@ -416,14 +530,7 @@ def mentions_api(request):
     end = start + page_size
     page_items = filtered[start:end]
 
-    summary = {
-        "total_mentions": total_items,
-        "positive": positive_count,
-        "neutral": neutral_count,
-        "negative": negative_count,
-    }
-
-    return JsonResponse(
+    response = JsonResponse(
         {
             "mentions": page_items,
             "summary": summary,
@@ -435,6 +542,11 @@ def mentions_api(request):
             },
         }
     )
+    # Permite que el navegador reutilice la respuesta mientras dure la caché del servidor
+    patch_cache_control(
+        response, private=True, max_age=getattr(settings, "MENTIONS_CACHE_TTL", 60)
+    )
+    return response
 
 
 def dashboard(request):
@@ -449,6 +561,7 @@ def dashboard(request):
         "page_name": getattr(settings, "FB_PAGE_NAME", "Noticias del Meta"),
         "page_id": getattr(settings, "FB_PAGE_ID", ""),
         "ig_profile": ig_profile,
+        "mentions_cache_ttl": getattr(settings, "MENTIONS_CACHE_TTL", 60),
     }
     return render(request, "mentions/dashboard.html", context)
 
@@ -461,6 +574,14 @@ def connect_instagram(request):
     Redirige al diálogo OAuth de Meta para conectar una cuenta de Instagram profesional.
     Esta vista se usa desde el botón "Conectar Instagram" en el dashboard.
     """
+    # Si esta sesión ya conectó una cuenta y su token sigue vigente, no repetimos OAuth
+    ig_user_id = request.session.get("ig_user_id")
+    if ig_user_id:
+        account = tokens.get_account(ig_user_id)
+        if account is not None:
+            request.session["ig_profile"] = account.profile
+            return redirect("dashboard")
+
     client_id = getattr(settings, "META_APP_ID", None)
     if not client_id:
         return HttpResponse(
@@ -492,9 +613,11 @@ def connect_instagram(request):
 
 def instagram_callback(request):
     """
-    Recibe el `code` de Meta, intercambia por un access_token de usuario
-    y obtiene el perfil de la cuenta de Instagram profesional conectada.
-    Guarda un resumen del perfil en la sesión y redirige al dashboard.
+    Recibe el `code` de Meta, lo intercambia por un token de usuario de larga
+    duración y obtiene la página y el perfil de la cuenta de Instagram
+    profesional conectada (ver mentions/tokens.py).
+    Guarda la cuenta con sus tokens cifrados, un resumen del perfil en la
+    sesión y redirige al dashboard.
     Esta vista sirve para el flujo de App Review.
     """
     error = request.GET.get("error")
@@ -515,100 +638,37 @@ def instagram_callback(request):
 
     redirect_uri = "http://localhost:8000/instagram/callback/"
 
-    # 1) Intercambiar code por access_token de usuario
-    try:
-        token_resp = requests.get(
-            "https://graph.facebook.com/v21.0/oauth/access_token",
-            params={
-                "client_id": client_id,
-                "redirect_uri": redirect_uri,
-                "client_secret": client_secret,
-                "code": code,
-            },
-            timeout=15,
-        )
-        token_data = token_resp.json()
-    except Exception as e:
-        return HttpResponse(f"Error al obtener access_token: {e}", status=500)
-
-    user_access_token = token_data.get("access_token")
-    if not user_access_token:
-        return HttpResponse(f"Respuesta inesperada al obtener access_token: {token_data}", status=500)
-
-    # 2) Obtener páginas administradas por el usuario
+    # Intercambiar el code por un token de larga duración, resolver la página con
+    # Instagram conectado (una sola consulta agrupada) y guardar la cuenta cifrada
     try:
-        pages_resp = requests.get(
-            "https://graph.facebook.com/v21.0/me/accounts",
-            params={"access_token": user_access_token},
-            timeout=15,
-        )
-        pages_data = pages_resp.json()
-    except Exception as e:
-        return HttpResponse(f"Error al obtener las páginas administradas: {e}", status=500)
+        account = tokens.connect_account(code, redirect_uri)
+    except tokens.MetaTokenError as e:
+        return HttpResponse(f"Error al conectar la cuenta de Instagram: {e}", status=500)
 
-    ig_id = None
-    # Buscamos la primera página que tenga una cuenta de Instagram conectada
-    for p in pages_data.get("data", []):
-        page_id = p.get("id")
-        if not page_id:
-            continue
-        try:
-            detail_resp = requests.get(
-                f"{GRAPH_API_BASE}/{page_id}",
-                params={
-                    "access_token": user_access_token,
-                    "fields": "name,connected_instagram_account",
-                },
-                timeout=15,
-            )
-            detail = detail_resp.json()
-        except Exception:
-            continue
-
-        if "connected_instagram_account" in detail:
-            ig_account = detail.get("connected_instagram_account") or {}
-            ig_id = ig_account.get("id")
-            break
-
-    if not ig_id:
+    if account is None:
         return HttpResponse(
             "No se encontró ninguna página con una cuenta de Instagram profesional conectada.",
             status=400,
         )
 
-    # 3) Obtener perfil de la cuenta de Instagram profesional
-    try:
-        ig_resp = requests.get(
-            f"{GRAPH_API_BASE}/{ig_id}",
-            params={
-                "access_token": user_access_token,
-                "fields": "id,username,biography,profile_picture_url",
-            },
-            timeout=15,
-        )
-        ig_profile = ig_resp.json()
-    except Exception as e:
-        return HttpResponse(f"Error al obtener el perfil de Instagram: {e}", status=500)
-
-    # 4) Guardar perfil simplificado en sesión para usarlo en el dashboard y para App Review
-    request.session["ig_profile"] = {
-        "id": ig_profile.get("id"),
-        "username": ig_profile.get("username"),
-        "biography": ig_profile.get("biography"),
-        "profile_picture_url": ig_profile.get("profile_picture_url"),
-    }
+    # Guardar perfil simplificado en sesión para usarlo en el dashboard y para App Review
+    request.session["ig_profile"] = account.profile
+    request.session["ig_user_id"] = account.ig_user_id
 
-    # (Opcional) aquí podrías guardar ig_id / tokens en BD para usarlos luego en las llamadas
-    # de menciones de Instagram. Para App Review basta con mostrar el perfil.
+    # Las menciones cacheadas se obtuvieron sin esta cuenta de Instagram
+    _invalidate_mentions_cache(account.ig_user_id)
 
     return redirect("dashboard")
 
 def disconnect_instagram(request):
     """
-    Elimina la información de la cuenta de Instagram conectada de la sesión
-    y vuelve al dashboard.
+    Desconecta la cuenta de Instagram: borra la cuenta y sus tokens de la BD,
+    limpia la sesión y descarta las menciones cacheadas de esa cuenta.
+    Después vuelve al dashboard.
     """
+    ig_user_id = request.session.pop("ig_user_id", None)
     request.session.pop("ig_profile", None)
-    # Si en el futuro guardas tokens/ig_id en sesión o BD,
-    # aquí también podrías limpiarlos.
+    if ig_user_id:
+        ConnectedAccount.objects.filter(ig_user_id=ig_user_id).delete()
+        _invalidate_mentions_cache(ig_user_id)
     return redirect("dashboard")